@@ -1,15 +1,46 @@
 from __future__ import annotations
 
+import functools
 import os
-from dotenv import load_dotenv
+from dataclasses import dataclass
 
-load_dotenv()
 
-DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///allergen_scanner.db")
-ACCESS_TOKEN_EXPIRE_HOURS: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_HOURS", "24"))
-ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
-SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
-OFF_API_BASE: str = os.getenv("OFF_API_BASE", "https://world.openfoodfacts.org/api/v0")
-CORS_ALLOW_ORIGINS: str = os.getenv("CORS_ALLOW_ORIGINS", "*")
-STALE_DAYS: int = int(os.getenv("STALE_DAYS", "7"))
+@dataclass(frozen=True, slots=True)
+class Settings:
+    database_url: str
+    access_token_expire_hours: int
+    algorithm: str
+    secret_key: str
+    off_api_base: str
+    cors_allow_origins: str
+    stale_days: int
+    # Connection pool sizing. Each in-flight request holds one session, so size the pool for expected
+    # concurrency (pool + overflow). Ignored for SQLite, which has a single writer.
+    db_pool_size: int
+    db_max_overflow: int
+    db_pool_recycle: int
+    # bcrypt work factor; lower (e.g. 4) for local dev/tests, keep >= 12 in production.
+    bcrypt_rounds: int
 
+
+@functools.lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    # Deployed containers already have their env vars set; only parse .env for local development.
+    if os.getenv("ENV", "dev") == "dev":
+        from dotenv import load_dotenv
+
+        load_dotenv(override=False)
+
+    return Settings(
+        database_url=os.getenv("DATABASE_URL", "sqlite+aiosqlite:///allergen_scanner.db"),
+        access_token_expire_hours=int(os.getenv("ACCESS_TOKEN_EXPIRE_HOURS", "24")),
+        algorithm=os.getenv("JWT_ALGORITHM", "HS256"),
+        secret_key=os.getenv("SECRET_KEY", "your-secret-key-change-in-production"),
+        off_api_base=os.getenv("OFF_API_BASE", "https://world.openfoodfacts.org/api/v0"),
+        cors_allow_origins=os.getenv("CORS_ALLOW_ORIGINS", "*"),
+        stale_days=int(os.getenv("STALE_DAYS", "7")),
+        db_pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+        db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "40")),
+        db_pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        bcrypt_rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+    )
@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+from typing import Any, Dict
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from . import tables  # noqa: F401
-from allergy_app.core.config import DATABASE_URL
+from allergy_app.core.config import get_settings
 import os
 
 
+settings = get_settings()
+
+
 def _ensure_sqlite_parent_dir(db_url: str) -> None:
     if not db_url.startswith("sqlite+aiosqlite:"):
         return
@@ -25,10 +32,46 @@ def _ensure_sqlite_parent_dir(db_url: str) -> None:
         pass
 
 
-_ensure_sqlite_parent_dir(DATABASE_URL)
-engine = create_async_engine(DATABASE_URL, future=True, echo=False)
+def _engine_kwargs(db_url: str) -> Dict[str, Any]:
+    if db_url.startswith("sqlite"):
+        if ":memory:" in db_url or db_url.rstrip("/").endswith(":"):
+            # In-memory databases keep the dialect's StaticPool: a second connection would see an empty DB.
+            return {}
+        # File databases get a small persistent pool so the per-connection PRAGMAs (page cache, mmap) survive
+        # across requests; SQLite is single-writer, so a handful of connections is enough.
+        return {"poolclass": AsyncAdaptedQueuePool, "pool_size": 5, "max_overflow": 5}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_pre_ping": True,
+        "pool_recycle": settings.db_pool_recycle,
+    }
+
+
+_ensure_sqlite_parent_dir(settings.database_url)
+engine = create_async_engine(settings.database_url, future=True, echo=False, **_engine_kwargs(settings.database_url))
+
+if settings.database_url.startswith("sqlite"):
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragma(dbapi_conn, _):
+        # Runs once per pooled connection. WAL lets readers run alongside the single writer; NORMAL sync is
+        # durable enough under WAL.
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.execute("PRAGMA cache_size=-64000")
+        cur.close()
+
 AsyncSessionMaker = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# Dialect-specific INSERT exposing on_conflict_do_update(), picked once for the configured engine.
+if engine.dialect.name == "postgresql":
+    from sqlalchemy.dialects.postgresql import insert as upsert_insert
+else:
+    from sqlalchemy.dialects.sqlite import insert as upsert_insert
+
 async def get_db():
     async with AsyncSessionMaker() as session:
         yield session
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime, timezone
 from enum import Enum as PyEnum
-from sqlalchemy import JSON, Column, DateTime, Enum as SAEnum, ForeignKey, Integer, String, Text, Index
+from sqlalchemy import JSON, Column, DateTime, Enum as SAEnum, ForeignKey, Integer, LargeBinary, String, Text, Index
 from sqlalchemy.orm import relationship, declarative_base
 
 
@@ -50,7 +50,7 @@ class ScanHistory(Base):
     __tablename__ = "scan_history"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
     risk_level = Column(SAEnum(RiskLevel, native_enum=False), nullable=False)
     matched_allergens = Column(JSON, nullable=False, default=list)
@@ -59,12 +59,17 @@ class ScanHistory(Base):
     user = relationship("User", back_populates="scans", lazy="raise")
     product = relationship("Product", back_populates="scans", lazy="raise")
 
+    __table_args__ = (
+        # Serves /scan-history: filter by user, newest first, without a sort step.
+        Index("ix_scan_user_time", "user_id", scanned_at.desc()),
+    )
+
 
 class ApiCache(Base):
     __tablename__ = "api_cache"
 
     id = Column(Integer, primary_key=True)
     key = Column(String(512), unique=True, index=True, nullable=False)
-    data = Column(Text, nullable=False)
+    data = Column(LargeBinary, nullable=False)
     fetched_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
 
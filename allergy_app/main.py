@@ -1,21 +1,24 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 import io
+import re
+import uuid
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
 
 from fastapi import Depends, FastAPI, HTTPException, Path, UploadFile, File
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
-from PIL import Image
-from pyzbar.pyzbar import decode
 from pydantic import BaseModel, EmailStr, Field, field_validator
-from sqlalchemy import select, func
+from sqlalchemy import func, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
-from allergy_app.core.config import CORS_ALLOW_ORIGINS, STALE_DAYS
+from allergy_app.core.config import get_settings
 from allergy_app.core.logging import configure_logging, RequestIdFilter
-from allergy_app.db.session import engine, AsyncSessionMaker
+from allergy_app.db.session import engine, AsyncSessionMaker, get_db, upsert_insert
 from allergy_app.db.tables import Base, User, Product, ScanHistory, RiskLevel
 from allergy_app.security.auth import (
     get_password_hash,
@@ -23,31 +26,57 @@ from allergy_app.security.auth import (
     create_access_token,
     get_current_user,
 )
-from allergy_app.services.off_client import fetch_product
+from allergy_app.services.off_client import close_client, fetch_product, product_cache_key, store_api_cache
 from allergy_app.utils.allergens import detect_allergens, compute_risk_level
 
+if TYPE_CHECKING:
+    from PIL import Image
 
+
+settings = get_settings()
 logger = configure_logging()
 
-app = FastAPI(title="Allergy Scanner API", version="1.0.0")
+# Max parallel Open Food Facts requests a single /scan/bulk call may make.
+BULK_UPSTREAM_CONCURRENCY = 8
+
+app = FastAPI(title="Allergy Scanner API", version="1.0.0", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*" if CORS_ALLOW_ORIGINS == "*" else origin.strip() for origin in CORS_ALLOW_ORIGINS.split(",")],
+    allow_origins=[
+        "*" if settings.cors_allow_origins == "*" else origin.strip()
+        for origin in settings.cors_allow_origins.split(",")
+    ],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 
+# Inbound ids are echoed into logs and response headers, so only accept short, plain tokens.
+_REQUEST_ID_RE = re.compile(r"[A-Za-z0-9._-]{1,128}")
+
+
+def _inbound_request_id(request) -> Optional[str]:
+    rid = request.headers.get("x-request-id")
+    if rid and _REQUEST_ID_RE.fullmatch(rid):
+        return rid
+    # W3C traceparent: "<version>-<trace-id>-<parent-id>-<flags>"; reuse the trace id.
+    parts = request.headers.get("traceparent", "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and _REQUEST_ID_RE.fullmatch(parts[1]):
+        return parts[1]
+    return None
+
+
 @app.middleware("http")
 async def add_request_id(request, call_next):
-    import uuid
-
-    rid = str(uuid.uuid4())
-    RequestIdFilter.request_id_var.set(rid)
+    rid = _inbound_request_id(request) or uuid.uuid4().hex
+    token = RequestIdFilter.request_id_var.set(rid)
     request.state.request_id = rid
-    response = await call_next(request)
+    try:
+        response = await call_next(request)
+    finally:
+        RequestIdFilter.request_id_var.reset(token)
     response.headers["X-Request-ID"] = rid
     return response
 
@@ -88,6 +117,15 @@ class ScanRequest(BaseModel):
         return v.strip() if v else v
 
 
+class BulkScanRequest(BaseModel):
+    barcodes: List[str] = Field(min_length=1, max_length=50)
+
+    @field_validator("barcodes")
+    @classmethod
+    def strip_barcodes(cls, v: List[str]) -> List[str]:
+        return [b.strip() for b in v]
+
+
 class ScanResponse(BaseModel):
     product_name: Optional[str]
     brand: Optional[str]
@@ -99,6 +137,12 @@ class ScanResponse(BaseModel):
     message: str
 
 
+class BulkScanResult(BaseModel):
+    barcode: str
+    result: Optional[ScanResponse] = None
+    error: Optional[str] = None
+
+
 class ProductResponse(BaseModel):
     name: Optional[str]
     brand: Optional[str]
@@ -115,29 +159,68 @@ class ScanHistoryEntry(BaseModel):
 
 
 def decode_barcode_from_image(image_b64: str) -> Optional[str]:
-    try:
-        image_bytes = base64.b64decode(image_b64)
-    except Exception:
-        return None
+    """Decode a base64-encoded image; raises ValueError if it is not valid base64."""
+    return decode_barcode_from_bytes(base64.b64decode(image_b64, validate=True))
+
+
+def _otsu_threshold(gray: Image.Image) -> int:
+    hist = gray.histogram()
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_bg = weight_bg = 0
+    best_t, best_var = 0, -1.0
+    for t, h in enumerate(hist):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        var = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if var > best_var:
+            best_t, best_var = t, var
+    return best_t
+
+
+def _barcode_candidates(img: Image.Image) -> Iterator[Image.Image]:
+    # Progressively stronger cleanups for blurry / low-contrast photos; zbar is retried after each.
+    from PIL import ImageFilter, ImageOps
+
+    gray = img.convert("L")
+    yield gray
+    stretched = ImageOps.autocontrast(gray)
+    yield stretched
+    threshold = _otsu_threshold(stretched)
+    binary = stretched.point(lambda v: 255 if v > threshold else 0)
+    yield binary
+    yield ImageOps.equalize(gray)
+    yield binary.filter(ImageFilter.MaxFilter(3)).filter(ImageFilter.MinFilter(3))
+
+
+def decode_barcode_from_bytes(image_bytes: bytes) -> Optional[str]:
+    # Imported lazily: barcode-only scans never need Pillow or libzbar. An ImportError (e.g. libzbar
+    # missing) is left to propagate so the endpoints can answer 503 instead of "no barcode detected".
+    from PIL import Image
+    from pyzbar.pyzbar import decode
+
     try:
         with Image.open(io.BytesIO(image_bytes)) as img:
-            barcodes = decode(img.convert("RGB"))
-            if not barcodes:
-                return None
-            return barcodes[0].data.decode("utf-8")
+            for candidate in _barcode_candidates(img):
+                barcodes = decode(candidate)
+                if barcodes:
+                    return barcodes[0].data.decode("utf-8")
+            return None
     except Exception:
         return None
 
 
-async def get_db():
-    async with AsyncSessionMaker() as session:
-        yield session
-
-
 @app.post("/register", response_model=TokenResponse)
 async def register_user(payload: RegisterRequest, db: AsyncSession = Depends(get_db)) -> TokenResponse:
-    existing = await db.scalar(select(User).where(User.email == payload.email))
-    if existing:
+    existing = await db.scalar(select(User.id).where(User.email == payload.email))
+    if existing is not None:
         raise HTTPException(status_code=400, detail="Email already registered")
     hashed = get_password_hash(payload.password)
     user = User(email=str(payload.email), hashed_password=hashed, allergens=[a.lower() for a in payload.allergens])
@@ -161,13 +244,7 @@ async def get_profile(current_user: User = Depends(get_current_user)) -> Profile
     return ProfileResponse(email=current_user.email, allergens=current_user.allergens or [])
 
 
-async def upsert_product_from_off(barcode: str, db: AsyncSession) -> Product:
-    try:
-        data = await fetch_product(barcode, db=db)
-        if data.get("status") != 1:
-            raise HTTPException(status_code=404, detail="Product not found")
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Failed to fetch product data: {str(e)}")
+def _product_values(data: Dict[str, Any], now: datetime) -> Dict[str, Any]:
     p = data.get("product", {})
     name = p.get("product_name") or p.get("product_name_en") or p.get("generic_name")
     brand = p.get("brands")
@@ -177,62 +254,92 @@ async def upsert_product_from_off(barcode: str, db: AsyncSession) -> Product:
     direct, may_c, confidences = detect_allergens(ingredients_text)
     allergens_found = sorted(direct)
 
-    existing = await db.scalar(select(Product).where(Product.barcode == barcode))
-    now = datetime.now(timezone.utc)
-    if existing:
-        existing.name = name
-        existing.brand = brand
-        existing.ingredients_text = ingredients_text
-        existing.allergens_found = allergens_found
-        existing.image_url = image_url
-        existing.last_fetched = now
-        await db.flush()
-        return existing
-    new_product = Product(
-        barcode=barcode,
-        name=name,
-        brand=brand,
-        ingredients_text=ingredients_text,
-        allergens_found=allergens_found,
-        image_url=image_url,
-        last_fetched=now,
+    return {
+        "name": name,
+        "brand": brand,
+        "ingredients_text": ingredients_text,
+        "allergens_found": allergens_found,
+        "image_url": image_url,
+        "last_fetched": now,
+    }
+
+
+async def _upsert_product(barcode: str, values: Dict[str, Any], db: AsyncSession) -> Product:
+    stmt = (
+        upsert_insert(Product)
+        .values(barcode=barcode, **values)
+        .on_conflict_do_update(index_elements=[Product.barcode], set_=values)
+        .returning(Product)
     )
-    db.add(new_product)
-    await db.flush()
-    return new_product
+    return await db.scalar(stmt, execution_options={"populate_existing": True})
 
 
-async def get_or_refresh_product(barcode: str, db: AsyncSession) -> Product:
+async def upsert_product_from_off(barcode: str, db: AsyncSession, now: datetime) -> Product:
+    try:
+        data = await fetch_product(barcode, db=db)
+        if data.get("status") != 1:
+            raise HTTPException(status_code=404, detail="Product not found")
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Failed to fetch product data: {str(e)}")
+    return await _upsert_product(barcode, _product_values(data, now), db)
+
+
+def _is_fresh(product: Optional[Product], now: datetime) -> bool:
+    if product is None or product.last_fetched is None:
+        return False
+    # Ensure both datetimes have the same timezone awareness
+    last_fetched = product.last_fetched
+    if last_fetched.tzinfo is None:
+        last_fetched = last_fetched.replace(tzinfo=timezone.utc)
+    return (now - last_fetched) <= timedelta(days=settings.stale_days)
+
+
+async def get_or_refresh_product(barcode: str, db: AsyncSession, now: datetime) -> Product:
     product = await db.scalar(select(Product).where(Product.barcode == barcode))
-    now = datetime.now(timezone.utc)
-    if product and product.last_fetched:
-        # Ensure both datetimes have the same timezone awareness
-        last_fetched = product.last_fetched
-        if last_fetched.tzinfo is None:
-            last_fetched = last_fetched.replace(tzinfo=timezone.utc)
-        if (now - last_fetched) <= timedelta(days=STALE_DAYS):
-            return product
-    return await upsert_product_from_off(barcode, db)
+    if product is not None and _is_fresh(product, now):
+        return product
+    return await upsert_product_from_off(barcode, db, now)
+
+
+def build_scan_response(product: Product, risk_level: RiskLevel, matched_for_user: List[str], user_allergens: List[str]) -> ScanResponse:
+    message = {
+        RiskLevel.DANGER: f"WARNING: Contains {', '.join(matched_for_user)}",
+        RiskLevel.WARNING: f"CAUTION: May contain {', '.join(matched_for_user)}",
+        RiskLevel.SAFE: "SAFE: No matching allergens detected",
+    }[risk_level]
+
+    return ScanResponse(
+        product_name=product.name,
+        brand=product.brand,
+        risk_level=risk_level,
+        matched_allergens=matched_for_user,
+        user_allergens=user_allergens,
+        ingredients=product.ingredients_text,
+        image_url=product.image_url,
+        message=message,
+    )
 
 
 @app.post("/scan", response_model=ScanResponse)
 async def scan_product(payload: ScanRequest, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)) -> ScanResponse:
+    now = datetime.now(timezone.utc)
     barcode: Optional[str] = payload.barcode
     if not barcode:
         if not payload.image:
             raise HTTPException(status_code=400, detail="Provide either 'barcode' or 'image'")
-        # Validate base64
+        # Decoding is CPU-bound (PIL + zbar); keep it off the event loop.
         try:
-            base64.b64decode(payload.image, validate=True)
-        except Exception:
+            decoded = await asyncio.to_thread(decode_barcode_from_image, payload.image)
+        except ValueError:
             raise HTTPException(status_code=400, detail="Invalid base64 image data")
-        decoded = decode_barcode_from_image(payload.image)
+        except ImportError:
+            raise HTTPException(status_code=503, detail="Barcode decoding unavailable: zbar library not installed")
         if not decoded:
             raise HTTPException(status_code=400, detail="No barcode detected in image")
         barcode = decoded
 
-    product = await get_or_refresh_product(barcode, db)
-    direct, may_c, confidences = detect_allergens(product.ingredients_text)
+    product = await get_or_refresh_product(barcode, db, now)
+    direct, may_c, confidences = detect_allergens(product.ingredients_text, current_user.allergens or [])
     risk_level, matched_for_user = compute_risk_level(current_user.allergens or [], direct, may_c, confidences)
 
     scan = ScanHistory(
@@ -240,27 +347,77 @@ async def scan_product(payload: ScanRequest, current_user: User = Depends(get_cu
         product_id=int(product.id),
         risk_level=risk_level,
         matched_allergens=matched_for_user,
-        scanned_at=datetime.now(timezone.utc),
+        scanned_at=now,
     )
     db.add(scan)
+    # Single commit covers the product / API cache upserts and the scan row.
     await db.commit()
 
-    message = {
-        RiskLevel.DANGER: f"WARNING: Contains {', '.join(matched_for_user)}",
-        RiskLevel.WARNING: f"CAUTION: May contain {', '.join(matched_for_user)}",
-        RiskLevel.SAFE: "SAFE: No matching allergens detected",
-    }[risk_level]
+    return build_scan_response(product, risk_level, matched_for_user, current_user.allergens or [])
 
-    return ScanResponse(
-        product_name=product.name,
-        brand=product.brand,
-        risk_level=risk_level,
-        matched_allergens=matched_for_user,
-        user_allergens=current_user.allergens or [],
-        ingredients=product.ingredients_text,
-        image_url=product.image_url,
-        message=message,
-    )
+
+@app.post("/scan/bulk", response_model=List[BulkScanResult])
+async def scan_products_bulk(payload: BulkScanRequest, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)) -> List[BulkScanResult]:
+    now = datetime.now(timezone.utc)
+    user_allergens = current_user.allergens or []
+    barcodes = list(dict.fromkeys(payload.barcodes))
+    products: Dict[str, Product] = {
+        p.barcode: p for p in await db.scalars(select(Product).where(Product.barcode.in_(barcodes)))
+    }
+    # End the read transaction before going upstream so no SQLite snapshot or lock is held while we wait.
+    await db.commit()
+
+    # Upstream fetches run concurrently and without the session (an AsyncSession can't be shared
+    # across tasks), capped so one batch can't flood Open Food Facts.
+    stale = [b for b in barcodes if not _is_fresh(products.get(b), now)]
+    upstream_slots = asyncio.Semaphore(BULK_UPSTREAM_CONCURRENCY)
+
+    async def fetch_limited(barcode: str) -> Dict[str, Any]:
+        async with upstream_slots:
+            return await fetch_product(barcode, db=None)
+
+    fetched = await asyncio.gather(*(fetch_limited(b) for b in stale), return_exceptions=True)
+    errors: Dict[str, str] = {}
+    refreshed: Dict[str, Dict[str, Any]] = {}
+    for barcode, data in zip(stale, fetched):
+        if isinstance(data, BaseException):
+            errors[barcode] = f"Failed to fetch product data: {data}"
+        elif data.get("status") != 1:
+            errors[barcode] = "Product not found"
+        else:
+            refreshed[barcode] = data
+
+    # All writes happen in one short transaction once the upstream data is in hand. The payloads also go
+    # to the ApiCache tier, which fetch_product skipped without a session, so other workers can reuse them.
+    for barcode, data in refreshed.items():
+        await store_api_cache(product_cache_key(barcode), data, db, now)
+        products[barcode] = await _upsert_product(barcode, _product_values(data, now), db)
+
+    history_rows: List[Dict[str, Any]] = []
+    results: List[BulkScanResult] = []
+    for barcode in payload.barcodes:
+        if barcode in errors:
+            results.append(BulkScanResult(barcode=barcode, error=errors[barcode]))
+            continue
+        product = products[barcode]
+        direct, may_c, confidences = detect_allergens(product.ingredients_text, user_allergens)
+        risk_level, matched_for_user = compute_risk_level(user_allergens, direct, may_c, confidences)
+        history_rows.append(
+            {
+                "user_id": int(current_user.id),
+                "product_id": int(product.id),
+                "risk_level": risk_level,
+                "matched_allergens": matched_for_user,
+                "scanned_at": now,
+            }
+        )
+        results.append(BulkScanResult(barcode=barcode, result=build_scan_response(product, risk_level, matched_for_user, user_allergens)))
+
+    if history_rows:
+        # One executemany INSERT for all history rows, committed together with the product refreshes.
+        await db.execute(insert(ScanHistory), history_rows)
+    await db.commit()
+    return results
 
 
 @app.post("/scan/test-image")
@@ -270,8 +427,10 @@ async def scan_test_image(file: UploadFile = File(...)) -> Dict[str, Any]:
     except Exception:
         raise HTTPException(status_code=400, detail="Failed to read uploaded file")
 
-    b64 = base64.b64encode(contents).decode("ascii")
-    decoded = decode_barcode_from_image(b64)
+    try:
+        decoded = await asyncio.to_thread(decode_barcode_from_bytes, contents)
+    except ImportError:
+        raise HTTPException(status_code=503, detail="Barcode decoding unavailable: zbar library not installed")
     if not decoded:
         raise HTTPException(status_code=400, detail="No barcode detected in uploaded image")
     return {"barcode": decoded, "filename": file.filename}
@@ -279,17 +438,17 @@ async def scan_test_image(file: UploadFile = File(...)) -> Dict[str, Any]:
 
 @app.get("/scan-history", response_model=List[ScanHistoryEntry])
 async def get_scan_history(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)) -> List[ScanHistoryEntry]:
-    from sqlalchemy import select
     stmt = (
-        select(ScanHistory, Product)
-        .join(Product, Product.id == ScanHistory.product_id)
+        select(ScanHistory)
+        .options(joinedload(ScanHistory.product))
         .where(ScanHistory.user_id == current_user.id)
         .order_by(ScanHistory.scanned_at.desc())
         .limit(20)
     )
-    rows = (await db.execute(stmt)).all()
+    scans = (await db.scalars(stmt)).all()
     results: List[ScanHistoryEntry] = []
-    for scan, product in rows:
+    for scan in scans:
+        product = scan.product
         results.append(
             ScanHistoryEntry(
                 product_name=product.name,
@@ -304,7 +463,9 @@ async def get_scan_history(current_user: User = Depends(get_current_user), db: A
 
 @app.get("/product/{barcode}", response_model=ProductResponse)
 async def get_product(barcode: str = Path(..., min_length=4, max_length=64), db: AsyncSession = Depends(get_db)) -> ProductResponse:
-    product = await get_or_refresh_product(barcode, db)
+    product = await get_or_refresh_product(barcode, db, datetime.now(timezone.utc))
+    # Persist any product / API cache upserts made while refreshing.
+    await db.commit()
     return ProductResponse(
         name=product.name,
         brand=product.brand,
@@ -327,14 +488,18 @@ async def on_startup() -> None:
         count = await session.scalar(select(func.count(User.id)))
         if count == 0:
             test_email = "test@example.com"
-            test_password = "test123"
             test_allergens = ["nuts", "dairy"]
             user = User(
                 email=test_email,
-                hashed_password=get_password_hash(test_password),
+                # Hashed only when seeding, with the configured BCRYPT_ROUNDS, so login cost matches other users.
+                hashed_password=get_password_hash("test123"),
                 allergens=test_allergens,
                 created_at=datetime.now(timezone.utc),
             )
             session.add(user)
             await session.commit()
 
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await close_client()
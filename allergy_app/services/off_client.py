@@ -1,52 +1,130 @@
 from __future__ import annotations
 
-import json
 from datetime import datetime, timezone, timedelta
 from typing import Any, Dict, Optional, Callable
 
 import httpx
+import orjson
+from cachetools import TTLCache
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from allergy_app.core.config import OFF_API_BASE
+from allergy_app.core.config import get_settings
+from allergy_app.db.session import upsert_insert
 from allergy_app.db.tables import ApiCache
 
 
-def sqlite_cache(ttl_seconds: int, key_builder: Callable[..., str]):
+settings = get_settings()
+
+
+# Shared client so connections (and the HTTP/2 session) to Open Food Facts are pooled across requests.
+_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(10.0, connect=5.0),
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    headers={"User-Agent": "allergy-scanner/1.0"},
+)
+
+
+async def close_client() -> None:
+    await _client.aclose()
+
+
+async def store_api_cache(key: str, data: Any, db: AsyncSession, now: datetime) -> None:
+    payload = orjson.dumps(data)
+    await db.execute(
+        upsert_insert(ApiCache)
+        .values(key=key, data=payload, fetched_at=now)
+        .on_conflict_do_update(index_elements=[ApiCache.key], set_={"data": payload, "fetched_at": now})
+    )
+
+
+def sqlite_cache(
+    ttl_seconds: int,
+    key_builder: Callable[..., str],
+    maxsize: int = 2_000,
+    should_cache: Callable[[Any], bool] = lambda data: True,
+):
+    """Two-tier cache: an in-process TTL cache (L1) in front of the ApiCache table (L2).
+
+    L1 hits never touch the database; L2 keeps entries shared across worker processes.
+    Results rejected by `should_cache` (e.g. transient errors) are returned but stored in neither tier.
+    """
     def decorator(func):
+        mem_cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+
         async def wrapper(*args, **kwargs):
+            key = key_builder(*args, **kwargs)
+            try:
+                return mem_cache[key]
+            except KeyError:
+                pass
             db: Optional[AsyncSession] = kwargs.get("db")
             if db is None:
-                return await func(*args, **kwargs)
-            key = key_builder(*args, **kwargs)
+                data = await func(*args, **kwargs)
+                if should_cache(data):
+                    mem_cache[key] = data
+                return data
             now = datetime.now(timezone.utc)
             entry = await db.scalar(select(ApiCache).where(ApiCache.key == key))
-            if entry and (now - entry.fetched_at) <= timedelta(seconds=ttl_seconds):
-                try:
-                    return json.loads(entry.data)
-                except Exception:
-                    pass
-            data = await func(*args, **kwargs)
             if entry:
-                entry.data = json.dumps(data)
-                entry.fetched_at = now
-            else:
-                db.add(ApiCache(key=key, data=json.dumps(data), fetched_at=now))
-            await db.flush()
+                fetched_at = entry.fetched_at
+                if fetched_at.tzinfo is None:
+                    fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+                if (now - fetched_at) <= timedelta(seconds=ttl_seconds):
+                    try:
+                        data = orjson.loads(entry.data)
+                    except Exception:
+                        pass
+                    else:
+                        mem_cache[key] = data
+                        return data
+            data = await func(*args, **kwargs)
+            if not should_cache(data):
+                return data
+            await store_api_cache(key, data, db, now)
+            mem_cache[key] = data
             return data
         return wrapper
     return decorator
 
 
-@sqlite_cache(ttl_seconds=7 * 24 * 3600, key_builder=lambda barcode, **kwargs: f"OFF:product:{barcode}")
-async def fetch_product(barcode: str, *, db: AsyncSession) -> Dict[str, Any]:
-    url = f"{OFF_API_BASE.rstrip('/')}/product/{barcode}.json"
-    timeout = httpx.Timeout(10.0, connect=5.0)
+# The only product fields upsert_product_from_off reads; everything else in the OFF payload
+# (nutriments, images, per-language tags...) is dropped before caching to keep entries small.
+PRODUCT_FIELDS = (
+    "product_name",
+    "product_name_en",
+    "generic_name",
+    "brands",
+    "ingredients_text",
+    "ingredients_text_en",
+    "image_url",
+)
+
+
+def product_cache_key(barcode: str) -> str:
+    return f"OFF:product:{barcode}"
+
+
+@sqlite_cache(
+    ttl_seconds=7 * 24 * 3600,
+    key_builder=lambda barcode, **kwargs: product_cache_key(barcode),
+    should_cache=lambda data: "error" not in data,
+)
+async def fetch_product(barcode: str, *, db: Optional[AsyncSession] = None) -> Dict[str, Any]:
+    url = f"{settings.off_api_base.rstrip('/')}/product/{barcode}.json"
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            resp = await client.get(url)
-        return resp.json()
+        resp = await _client.get(url)
+        # 404 is OFF's answer for an unknown barcode (a JSON body with status 0) and is safe to cache;
+        # any other non-2xx (429, 5xx) is transient and must not be cached as "not found".
+        if not resp.is_success and resp.status_code != 404:
+            return {"status": 0, "error": f"HTTP {resp.status_code}"}
+        data = resp.json()
     except Exception as e:
         print(f"Error fetching product {barcode}: {e}")
         return {"status": 0, "error": str(e)}
-
+    product = data.get("product") or {}
+    return {
+        "status": data.get("status"),
+        "product": {field: product[field] for field in PRODUCT_FIELDS if field in product},
+    }
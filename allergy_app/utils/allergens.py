@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import re
-import difflib
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Set, Tuple
+
+from rapidfuzz import fuzz, process
 
 
 ALLERGEN_KEYWORDS: Dict[str, List[str]] = {
@@ -124,79 +125,84 @@ def _normalize_text(text: Optional[str]) -> str:
     return " ".join(text.lower().split())
 
 
-def _build_keyword_patterns() -> Dict[str, List[str]]:
-    patterns: Dict[str, List[str]] = {}
-    for allergen, keywords in ALLERGEN_KEYWORDS.items():
-        compiled: List[str] = []
-        for kw in keywords:
-            escaped = "".join(["\\" + c if c in ".^$*+?{}[]|()" else c for c in kw])
-            compiled.append(rf"\b{escaped}\b")
-        patterns[allergen] = compiled
-    return patterns
+def _build_keyword_patterns() -> Dict[str, Pattern[str]]:
+    # One alternation per allergen so a scan costs a single regex pass instead of one per keyword.
+    return {
+        allergen: re.compile(r"\b(?:" + "|".join(re.escape(kw) for kw in keywords) + r")\b", re.IGNORECASE)
+        for allergen, keywords in ALLERGEN_KEYWORDS.items()
+    }
 
 
-KEYWORD_PATTERNS: Dict[str, List[str]] = _build_keyword_patterns()
+COMPILED_PATTERNS: Dict[str, Pattern[str]] = _build_keyword_patterns()
 
+# "may contain ..." clause, up to 80 chars and not past the end of the sentence.
+MAY_CONTAIN_RE: Pattern[str] = re.compile(r"may contain[^.]{0,80}")
 
-def _tokenize(text: str) -> List[str]:
-    return [t for t in re.split(r"[^a-z0-9]+", text.lower()) if t]
+# Flattened (allergen, keyword) pairs so fuzzy matching can score every keyword in one C-level call.
+ALL_KEYWORDS: List[Tuple[str, str]] = [(allergen, kw) for allergen, kws in ALLERGEN_KEYWORDS.items() for kw in kws]
+KW_STRINGS: List[str] = [kw for _, kw in ALL_KEYWORDS]
 
 
-def _ngram(tokens: List[str], n: int) -> List[str]:
-    return [" ".join(tokens[i : i + n]) for i in range(len(tokens) - n + 1)]
+def _tokenize(text: str) -> List[str]:
+    return [t for t in re.split(r"[^a-z0-9]+", text.lower()) if t]
 
 
-def fuzzy_ratio(a: str, b: str) -> float:
-    return difflib.SequenceMatcher(None, a, b).ratio()
+def _all_grams(tokens: List[str]) -> Iterator[str]:
+    yield from tokens
+    for n in (2, 3):
+        for i in range(len(tokens) - n + 1):
+            yield " ".join(tokens[i : i + n])
 
 
-def detect_allergens(ingredients_text: Optional[str]) -> Tuple[Set[str], Set[str], Dict[str, float]]:
+def detect_allergens(
+    ingredients_text: Optional[str], user_allergens: Optional[Iterable[str]] = None
+) -> Tuple[Set[str], Set[str], Dict[str, float]]:
     text = _normalize_text(ingredients_text)
     if not text:
         return set(), set(), {}
 
+    # Allergens outside the user's profile never affect compute_risk_level, so don't scan for them.
+    patterns = COMPILED_PATTERNS
+    if user_allergens is not None:
+        wanted = {a.lower() for a in user_allergens}
+        patterns = {a: p for a, p in COMPILED_PATTERNS.items() if a in wanted}
+        if not patterns:
+            return set(), set(), {}
+
     direct_matches: Set[str] = set()
     may_contain_matches: Set[str] = set()
     allergen_confidence: Dict[str, float] = {}
 
-    for allergen, patterns in KEYWORD_PATTERNS.items():
-        for pat in patterns:
-            if re.search(pat, text, flags=re.IGNORECASE):
-                direct_matches.add(allergen)
-                allergen_confidence[allergen] = max(allergen_confidence.get(allergen, 0.0), 1.0)
-                break
-
-    may_contain_indices = []
-    start = 0
-    needle = "may contain"
-    while True:
-        idx = text.find(needle, start)
-        if idx == -1:
-            break
-        may_contain_indices.append(idx)
-        start = idx + len(needle)
-
-    window_after = 80
-    for idx in may_contain_indices:
-        window = text[idx : idx + len(needle) + window_after]
-        for allergen, patterns in KEYWORD_PATTERNS.items():
-            for pat in patterns:
-                if re.search(pat, window, flags=re.IGNORECASE):
-                    may_contain_matches.add(allergen)
-                    allergen_confidence[allergen] = max(allergen_confidence.get(allergen, 0.0), 0.9)
-                    break
+    for allergen, pattern in patterns.items():
+        if pattern.search(text):
+            direct_matches.add(allergen)
+            allergen_confidence[allergen] = max(allergen_confidence.get(allergen, 0.0), 1.0)
+
+    for m in MAY_CONTAIN_RE.finditer(text):
+        window = m.group(0)
+        for allergen, pattern in patterns.items():
+            if allergen in may_contain_matches:
+                continue
+            if pattern.search(window):
+                may_contain_matches.add(allergen)
+                allergen_confidence[allergen] = max(allergen_confidence.get(allergen, 0.0), 0.9)
 
     tokens = _tokenize(text)
-    grams = set(tokens + _ngram(tokens, 2) + _ngram(tokens, 3))
+    grams = set(_all_grams(tokens))
     FUZZY_THRESHOLD = 0.85
-    for allergen, keywords in ALLERGEN_KEYWORDS.items():
-        for kw in keywords:
-            for gram in grams:
-                score = fuzzy_ratio(kw, gram)
-                if score >= FUZZY_THRESHOLD:
-                    direct_matches.add(allergen)
-                    allergen_confidence[allergen] = max(allergen_confidence.get(allergen, 0.0), float(score))
-                    break
+    # Exact regex hits already carry confidence 1.0; only fuzzy-score keywords of allergens still undecided.
+    choices = {
+        idx: kw
+        for idx, (allergen, kw) in enumerate(ALL_KEYWORDS)
+        if allergen in patterns and allergen not in direct_matches
+    }
+    for gram in grams if choices else ():
+        for _, score, idx in process.extract(
+            gram, choices, scorer=fuzz.ratio, score_cutoff=FUZZY_THRESHOLD * 100, limit=None
+        ):
+            allergen = ALL_KEYWORDS[idx][0]
+            direct_matches.add(allergen)
+            allergen_confidence[allergen] = max(allergen_confidence.get(allergen, 0.0), score / 100.0)
 
     return direct_matches, may_contain_matches, allergen_confidence
 
@@ -7,23 +7,48 @@ Run:
 This script will:
 1) Register a new user with an allergen profile
 2) Login to obtain a JWT token
-3) Scan several real Open Food Facts barcodes
-4) Fetch scan history
-5) Fetch product info
+3) Scan several real Open Food Facts barcodes (one /scan/bulk request, or /scan per barcode)
+4) Fetch product info
+5) Fetch scan history
 
-Uses httpx sync client. Prints colored PASS/FAIL with details.
+Uses an httpx async client; scans and product lookups run concurrently.
+Prints colored PASS/FAIL with details.
 """
 
 from __future__ import annotations
 
-import argparse
+import asyncio
 import os
+import random
 import sys
-import time
-from typing import Any, Dict, Optional, Tuple
+import uuid
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple, TypeVar
 
 import httpx
+import orjson
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+uvloop = None
+if sys.platform != "win32":
+    try:
+        import uvloop  # installed by uvicorn[standard]
+    except ImportError:
+        pass
+
+try:
+    import h2  # noqa: F401  (installed by httpx[http2])
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+T = TypeVar("T")
 
 # ANSI colors (avoid external dependencies)
 GREEN = "\033[92m"
@@ -33,177 +58,406 @@ CYAN = "\033[96m"
 RESET = "\033[0m"
 
 
+_PASS = f"{GREEN}PASS{RESET}"
+_FAIL = f"{RED}FAIL{RESET}"
+
+
 def color(text: str, c: str) -> str:
     return f"{c}{text}{RESET}"
 
 
+# Output is buffered and written once per test phase. Concurrent requests write to their own buffer
+# (see _collect) that the caller appends in a fixed order, so the report doesn't depend on timing.
+_OUTPUT: List[str] = []
+_TASK_OUTPUT: ContextVar[Optional[List[str]]] = ContextVar("_TASK_OUTPUT", default=None)
+
+
+def _out() -> List[str]:
+    buf = _TASK_OUTPUT.get()
+    return _OUTPUT if buf is None else buf
+
+
+async def _collect(coro: Awaitable[T]) -> Tuple[Any, List[str]]:
+    """Run `coro` with a private output buffer; return (result or raised exception, its output lines)."""
+    lines: List[str] = []
+    # gather() runs each coroutine in its own task and context copy, so this only affects `coro`.
+    _TASK_OUTPUT.set(lines)
+    try:
+        return await coro, lines
+    except Exception as e:
+        return e, lines
+
+
+def flush_results() -> None:
+    if _OUTPUT:
+        sys.stdout.write("\n".join(_OUTPUT) + "\n")
+        sys.stdout.flush()
+        _OUTPUT.clear()
+
+
 def print_header(title: str) -> None:
-    print("\n" + color(f"=== {title} ===", CYAN))
+    _out().append("\n" + color(f"=== {title} ===", CYAN))
 
 
 def print_result(name: str, ok: bool, details: str = "") -> None:
-    status = color("PASS", GREEN) if ok else color("FAIL", RED)
-    print(f"[{status}] {name}")
+    status = _PASS if ok else _FAIL
+    out = _out()
+    out.append(f"[{status}] {name}")
     if details:
-        print(details)
+        out.append(details)
+
+
+# Known barcodes from Open Food Facts (examples)
+TEST_BARCODES = (
+    ("3017620422003", "Nutella"),
+    ("5449000214799", "Coca-Cola"),
+    ("8076809513388", "Barilla pasta"),
+    ("3017620425035", "Ferrero Rocher"),
+)
+# Endpoint paths, resolved against the client's base_url.
+SCAN_PATH = "/scan"
+SCAN_BULK_PATH = "/scan/bulk"
+SCAN_HISTORY_PATH = "/scan-history"
+# Request bodies are pre-encoded with orjson and sent as raw content, skipping httpx's per-call json.dumps.
+JSON_HEADERS = {"content-type": "application/json"}
+# Per-barcode request descriptors, built once: (barcode, label, path[, body]).
+SCAN_BODIES: Tuple[Tuple[str, str, str, bytes], ...] = tuple(
+    (code, label, SCAN_PATH, orjson.dumps({"barcode": code})) for code, label in TEST_BARCODES
+)
+SCAN_BULK_BODY = orjson.dumps({"barcodes": [code for code, _ in TEST_BARCODES]})
+PRODUCT_PATHS: Tuple[Tuple[str, str, str], ...] = tuple(
+    (code, label, f"/product/{code}") for code, label in TEST_BARCODES
+)
+
+# Retry policy for transient upstream failures
+MAX_ATTEMPTS = 3
+RETRY_STATUSES = frozenset({502, 503, 504})
+MAX_RETRY_AFTER = 10.0  # seconds; never let a server's Retry-After stall the run longer than this
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# Upper bound on in-flight scan/product requests, so the backend's Open Food Facts upstream isn't flooded.
+CONCURRENCY = 8
+
+_HEALTH_KEYS = frozenset({"status"})
+_TOKEN_KEYS = frozenset({"access_token"})
+_PROFILE_KEYS = frozenset({"email", "allergens"})
+_SCAN_KEYS = frozenset({"risk_level", "user_allergens"})
+_PRODUCT_KEYS = frozenset({"name", "brand", "ingredients", "allergens_found"})
 
 
 def safe_json(response: httpx.Response) -> Tuple[bool, Any]:
-    try:
+    if response.headers.get("content-type", "").startswith("application/json"):
         return True, response.json()
-    except Exception:
-        return False, response.text
+    return False, response.text
 
 
-def request_with_logging(client: httpx.Client, method: str, url: str, *, headers: Optional[Dict[str, str]] = None, json: Optional[Dict[str, Any]] = None) -> httpx.Response:
-    try:
-        resp = client.request(method, url, headers=headers, json=json)
-        return resp
-    except httpx.RequestError as e:
-        print_result(f"HTTP {method} {url}", False, details=color(str(e), YELLOW))
-        raise
+def _validate(resp: httpx.Response, keys: Optional[frozenset] = None) -> Tuple[bool, Any]:
+    """Return (ok, data): 2xx, JSON body and, when `keys` is given, a dict containing all of them."""
+    ok_json, data = safe_json(resp)
+    if not (resp.is_success and ok_json):
+        return False, data
+    if keys is None:
+        return True, data
+    return isinstance(data, dict) and keys.issubset(data), data
+
+
+async def _guard(sem: asyncio.Semaphore, coro: Awaitable[T]) -> T:
+    async with sem:
+        return await coro
 
 
-def run_register(client: httpx.Client, base_url: str) -> Tuple[bool, Optional[str], str, str]:
+def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    if retry_after is not None:
+        try:
+            return min(MAX_RETRY_AFTER, max(0.0, float(retry_after)))
+        except ValueError:
+            pass  # HTTP-date form; fall back to exponential backoff
+    return 2**attempt * random.uniform(0.5, 1.0)
+
+
+def _retryable(method: str, exc: httpx.RequestError) -> bool:
+    # A failed connect means the request never reached the server, so any method can be resent. Other
+    # transport errors (read timeouts, dropped connections) may follow a request the server already
+    # processed, so only idempotent methods are retried for those.
+    if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    return isinstance(exc, httpx.TransportError) and method in IDEMPOTENT_METHODS
+
+
+def _retryable_status(method: str, status_code: int) -> bool:
+    # A 502/504 from a proxy can arrive after the app already handled the request, so gateway errors
+    # are only retried for idempotent methods. 503 means it was refused, which is safe to resend.
+    if status_code not in RETRY_STATUSES:
+        return False
+    return method in IDEMPOTENT_METHODS or status_code == 503
+
+
+async def request_with_logging(client: httpx.AsyncClient, method: str, url: str, *, headers: Optional[Dict[str, str]] = None, content: Optional[bytes] = None) -> httpx.Response:
+    # Retry transient failures (network errors, gateway 5xx) with jittered exponential backoff.
+    attempt = 0
+    while True:
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        try:
+            resp = await client.request(method, url, headers=headers, content=content)
+        except httpx.RequestError as e:
+            if last_attempt or not _retryable(method, e):
+                print_result(f"HTTP {method} {url}", False, details=color(str(e), YELLOW))
+                raise
+            await asyncio.sleep(_backoff_delay(attempt))
+            attempt += 1
+            continue
+        if not _retryable_status(method, resp.status_code) or last_attempt:
+            return resp
+        await asyncio.sleep(_backoff_delay(attempt, resp.headers.get("retry-after")))
+        attempt += 1
+
+
+async def run_health(client: httpx.AsyncClient) -> Tuple[bool, str]:
+    resp = await request_with_logging(client, "GET", "/health")
+    ok, data = _validate(resp, _HEALTH_KEYS)
+    ok = ok and data.get("status") == "healthy"
+    return ok, f"Status: {resp.status_code}\nResponse: {data}"
+
+
+async def run_register(client: httpx.AsyncClient) -> Tuple[bool, Optional[str], str, str]:
     """Register a new user with random email; return (ok, token, email, password)."""
-    print_header("Register User")
-    timestamp = int(time.time())
-    email = f"test_{timestamp}@example.com"
+    # Random suffix rather than a seconds timestamp, so back-to-back runs never collide on the email.
+    suffix = uuid.uuid4().hex[:12]
+    email = f"test_{suffix}@example.com"
     password = "test123"
     payload = {"email": email, "password": password, "allergens": ["nuts", "dairy"]}
-    url = f"{base_url}/register"
-    resp = request_with_logging(client, "POST", url, json=payload)
-    ok_json, data = safe_json(resp)
-    ok = resp.status_code == 200 and ok_json and isinstance(data, dict) and "access_token" in data
+    url = "/register"
+    body = orjson.dumps(payload)
+    resp = await request_with_logging(client, "POST", url, headers=JSON_HEADERS, content=body)
+    ok, data = _validate(resp, _TOKEN_KEYS)
     details = f"Status: {resp.status_code}\nResponse: {data}"
+    print_header("Register User")
     print_result("POST /register", ok, details)
     token = data.get("access_token") if ok else None  # type: ignore[attr-defined]
     return ok, token, email, password
 
 
-def run_login(client: httpx.Client, base_url: str, email: str, password: str) -> Tuple[bool, Optional[str]]:
-    print_header("Login")
-    url = f"{base_url}/login"
+async def run_login(client: httpx.AsyncClient, email: str, password: str) -> Tuple[bool, Optional[str]]:
+    url = "/login"
     payload = {"email": email, "password": password}
-    resp = request_with_logging(client, "POST", url, json=payload)
-    ok_json, data = safe_json(resp)
-    ok = resp.status_code == 200 and ok_json and isinstance(data, dict) and "access_token" in data
+    resp = await request_with_logging(client, "POST", url, headers=JSON_HEADERS, content=orjson.dumps(payload))
+    ok, data = _validate(resp, _TOKEN_KEYS)
     details = f"Status: {resp.status_code}\nResponse: {data}"
+    print_header("Login")
     print_result("POST /login", ok, details)
     token = data.get("access_token") if ok else None  # type: ignore[attr-defined]
     return ok, token
 
 
-def run_scan(client: httpx.Client, base_url: str, token: str, barcode: str, label: str) -> bool:
-    print_header(f"Scan product: {label} ({barcode})")
-    url = f"{base_url}/scan"
-    headers = {"Authorization": f"Bearer {token}"}
-    payload = {"barcode": barcode}
-    resp = request_with_logging(client, "POST", url, headers=headers, json=payload)
-    ok_json, data = safe_json(resp)
-    ok_structure = ok_json and isinstance(data, dict) and all(k in data for k in ["risk_level", "user_allergens"])
-    ok = resp.status_code == 200 and ok_structure
+async def run_scan(client: httpx.AsyncClient, barcode: str, label: str, url: str, body: bytes) -> bool:
+    resp = await request_with_logging(client, "POST", url, headers=JSON_HEADERS, content=body)
+    ok, data = _validate(resp, _SCAN_KEYS)
     details = f"Status: {resp.status_code}\nResponse: {data}"
+    print_header(f"Scan product: {label} ({barcode})")
     print_result("POST /scan", ok, details)
     return ok
 
 
-def run_scan_history(client: httpx.Client, base_url: str, token: str) -> bool:
+class _AsyncByteReader:
+    """Minimal async file-like adapter so ijson can consume an httpx byte stream."""
+
+    def __init__(self, chunks: AsyncIterator[bytes]) -> None:
+        self._chunks = chunks
+
+    async def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            # ijson probes with read(0) to detect bytes vs str; don't consume a chunk for it.
+            return b""
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+
+
+async def _count_json_list(resp: httpx.Response) -> Optional[int]:
+    """Count top-level list entries while streaming; None if the body is not a JSON list."""
+    is_list = False
+    count = 0
+    async for prefix, event, _ in ijson.parse(_AsyncByteReader(resp.aiter_bytes())):
+        if prefix == "" and event == "start_array":
+            is_list = True
+        elif prefix == "item" and event in ("start_map", "start_array", "string", "number", "boolean", "null"):
+            count += 1
+    return count if is_list else None
+
+
+async def run_scan_bulk(client: httpx.AsyncClient) -> Optional[bool]:
+    """Scan every test barcode in one request; return None if the server has no bulk endpoint."""
+    resp = await request_with_logging(client, "POST", SCAN_BULK_PATH, headers=JSON_HEADERS, content=SCAN_BULK_BODY)
+    if resp.status_code in (404, 405):
+        return None
+    ok, data = _validate(resp)
+    if not (ok and isinstance(data, list) and len(data) == len(TEST_BARCODES)):
+        print_header(f"Bulk scan: {', '.join(label for _, label in TEST_BARCODES)}")
+        print_result("POST /scan/bulk", False, f"Status: {resp.status_code}\nResponse: {data}")
+        return False
+    # The server answers per barcode (a scan result or an error), so report each one separately.
+    all_ok = True
+    for (code, label), entry in zip(TEST_BARCODES, data):
+        result = entry.get("result") if isinstance(entry, dict) else None
+        entry_ok = entry.get("barcode") == code and isinstance(result, dict) and _SCAN_KEYS.issubset(result)
+        print_header(f"Scan product: {label} ({code})")
+        print_result("POST /scan/bulk", entry_ok, f"Status: {resp.status_code}\nResponse: {entry}")
+        all_ok = all_ok and entry_ok
+    return all_ok
+
+
+async def _read_history(resp: httpx.Response) -> Tuple[bool, str]:
+    is_json = resp.headers.get("content-type", "").startswith("application/json")
+    if ijson is not None and resp.is_success and is_json:
+        count = await _count_json_list(resp)
+        ok = count is not None
+        return ok, f"Status: {resp.status_code}\nCount: {count if ok else 'n/a'}"
+    await resp.aread()
+    ok, data = _validate(resp)
+    ok = ok and isinstance(data, list)
+    return ok, f"Status: {resp.status_code}\nCount: {len(data) if isinstance(data, list) else 'n/a'}\nResponse: {data}"
+
+
+async def run_scan_history(client: httpx.AsyncClient) -> bool:
+    url = SCAN_HISTORY_PATH
+    # Only the entry count is checked, so stream the body instead of materializing the whole list.
+    # Streaming bypasses request_with_logging, so the same retry policy is applied here.
+    attempt = 0
+    while True:
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        retry_after: Optional[str] = None
+        try:
+            async with client.stream("GET", url) as resp:
+                if _retryable_status("GET", resp.status_code) and not last_attempt:
+                    retry_after = resp.headers.get("retry-after")
+                else:
+                    ok, details = await _read_history(resp)
+                    break
+        except httpx.RequestError as e:
+            if last_attempt or not _retryable("GET", e):
+                print_result(f"HTTP GET {url}", False, details=color(str(e), YELLOW))
+                raise
+        await asyncio.sleep(_backoff_delay(attempt, retry_after))
+        attempt += 1
     print_header("Scan History")
-    url = f"{base_url}/scan-history"
-    headers = {"Authorization": f"Bearer {token}"}
-    resp = request_with_logging(client, "GET", url, headers=headers)
-    ok_json, data = safe_json(resp)
-    ok_list = ok_json and isinstance(data, list)
-    ok = resp.status_code == 200 and ok_list
-    details = f"Status: {resp.status_code}\nCount: {len(data) if isinstance(data, list) else 'n/a'}\nResponse: {data}"
     print_result("GET /scan-history", ok, details)
     return ok
 
 
-def run_product(client: httpx.Client, base_url: str, barcode: str, label: str) -> bool:
-    print_header(f"Product info: {label} ({barcode})")
-    url = f"{base_url}/product/{barcode}"
-    resp = request_with_logging(client, "GET", url)
-    ok_json, data = safe_json(resp)
-    ok_structure = ok_json and isinstance(data, dict) and all(k in data for k in ["name", "brand", "ingredients", "allergens_found"])
-    ok = resp.status_code == 200 and ok_structure
+async def run_product(client: httpx.AsyncClient, barcode: str, label: str, url: str) -> bool:
+    resp = await request_with_logging(client, "GET", url)
+    ok, data = _validate(resp, _PRODUCT_KEYS)
     details = f"Status: {resp.status_code}\nResponse: {data}"
+    print_header(f"Product info: {label} ({barcode})")
     print_result("GET /product/{barcode}", ok, details)
     return ok
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser(description="Test the Allergy Scanner API")
-    parser.add_argument("--base-url", default=os.environ.get("ALLERGEN_API_BASE_URL", "http://127.0.0.1:8000"))
-    args = parser.parse_args()
-    base_url: str = args.base_url.rstrip("/")
-
-    # Known barcodes from Open Food Facts (examples)
-    test_barcodes = [
-        ("3017620422003", "Nutella"),
-        ("5449000214799", "Coca-Cola"),
-        ("8076809513388", "Barilla pasta"),
-        ("3017620425035", "Ferrero Rocher"),
-    ]
-
+async def amain(base_url: str) -> int:
     timeout = httpx.Timeout(20.0, connect=10.0)
-    with httpx.Client(base_url=base_url, timeout=timeout) as client:
-        try:
-            resp = request_with_logging(client, "GET", f"{base_url}/health")
-            ok_json, data = safe_json(resp)
-            ok = resp.status_code == 200 and ok_json and isinstance(data, dict) and data.get("status") == "healthy"
-            print_result("GET /health", ok, f"Status: {resp.status_code}\nResponse: {data}")
-        except Exception:
-            print(color("Health check failed; continuing tests...", YELLOW))
-
-        reg_ok, reg_token, email, password = run_register(client, base_url)
-        token: Optional[str] = reg_token
-
-        # If registration failed due to email reuse, still attempt login using generated credentials
-        login_ok = False
-        if not reg_ok:
-            login_ok, token = run_login(client, base_url, email, password)
+    # One pooled transport for every call: keep-alive matches the server's 15s so connections survive between
+    # phases, and HTTP/2 multiplexes the concurrent requests over one TLS connection. Limits and http2 must be
+    # set on the transport, since the client ignores them when a transport is passed.
+    transport = httpx.AsyncHTTPTransport(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_keepalive_connections=10, max_connections=10, keepalive_expiry=15.0),
+    )
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, transport=transport) as client:
+        # /health has no dependency on registration, so overlap the two; the health result is still
+        # reported first, ahead of the register block.
+        (health, health_lines), (registered, reg_lines) = await asyncio.gather(
+            _collect(run_health(client)), _collect(run_register(client))
+        )
+        _OUTPUT.extend(health_lines)
+        if isinstance(health, Exception):
+            _OUTPUT.append(color("Health check failed; continuing tests...", YELLOW))
         else:
-            # Validate token works by fetching profile
-            prof_url = f"{base_url}/profile"
-            resp = request_with_logging(client, "GET", prof_url, headers={"Authorization": f"Bearer {token}"})
-            ok_json, data = safe_json(resp)
-            ok = resp.status_code == 200 and ok_json and isinstance(data, dict) and data.get("email") == email
-            print_result("GET /profile", ok, f"Status: {resp.status_code}\nResponse: {data}")
-            login_ok = True
+            print_result("GET /health", *health)
+        _OUTPUT.extend(reg_lines)
+        flush_results()
+        if isinstance(registered, Exception):
+            raise registered
+        reg_ok, reg_token, email, password = registered
+        token: Optional[str] = reg_token
 
-        # If still no token, attempt login explicitly
+        # If registration failed (e.g. email reuse) or returned no token, attempt login with the generated credentials
+        login_ok = reg_ok
         if not token:
-            login_ok, token = run_login(client, base_url, email, password)
+            login_ok, token = await run_login(client, email, password)
 
         if not login_ok or not token:
-            print(color("Cannot continue tests without a valid token.", RED))
+            _OUTPUT.append(color("Cannot continue tests without a valid token.", RED))
             return 2
 
-        # Scan products
-        for code, label in test_barcodes:
-            try:
-                run_scan(client, base_url, token, code, label)
-            except Exception as e:
-                print_result(f"Scan {label}", False, details=color(str(e), YELLOW))
+        # Every request from here on is authenticated; set the header once on the client.
+        client.headers["Authorization"] = f"Bearer {token}"
 
-        # History
+        if reg_ok:
+            # Validate token works by fetching profile
+            resp = await request_with_logging(client, "GET", "/profile")
+            ok, data = _validate(resp, _PROFILE_KEYS)
+            ok = ok and data.get("email") == email
+            print_result("GET /profile", ok, f"Status: {resp.status_code}\nResponse: {data}")
+        flush_results()
+
+        sem = asyncio.Semaphore(CONCURRENCY)
+
+        # No explicit pool warmup: register/login above already opened (and, on HTTP/2, negotiated) the
+        # connection the wave below reuses.
+        # Scans and product lookups are independent, so run them as one concurrent wave.
+        # All barcodes go in a single /scan/bulk request when the server supports it.
+        product_coros = [_collect(_guard(sem, run_product(client, *spec))) for spec in PRODUCT_PATHS]
+        (bulk_result, bulk_lines), *product_outputs = await asyncio.gather(
+            _collect(_guard(sem, run_scan_bulk(client))), *product_coros
+        )
+        # Emit each request's block in TEST_BARCODES order, whatever order they completed in.
+        _OUTPUT.extend(bulk_lines)
+        if isinstance(bulk_result, Exception):
+            print_result("Bulk scan", False, details=color(str(bulk_result), YELLOW))
+        elif bulk_result is None:
+            # No bulk endpoint on this server; fall back to one /scan per barcode
+            scan_outputs = await asyncio.gather(*(_collect(_guard(sem, run_scan(client, *spec))) for spec in SCAN_BODIES))
+            for (code, label), (result, lines) in zip(TEST_BARCODES, scan_outputs):
+                _OUTPUT.extend(lines)
+                if isinstance(result, Exception):
+                    print_result(f"Scan {label}", False, details=color(str(result), YELLOW))
+        for (code, label), (result, lines) in zip(TEST_BARCODES, product_outputs):
+            _OUTPUT.extend(lines)
+            if isinstance(result, Exception):
+                print_result(f"Product {label}", False, details=color(str(result), YELLOW))
+        flush_results()
+
+        # History depends on the scans having landed server-side
         try:
-            run_scan_history(client, base_url, token)
+            await run_scan_history(client)
         except Exception as e:
             print_result("Scan history", False, details=color(str(e), YELLOW))
-
-        # Product info
-        for code, label in test_barcodes:
-            try:
-                run_product(client, base_url, code, label)
-            except Exception as e:
-                print_result(f"Product {label}", False, details=color(str(e), YELLOW))
+        flush_results()
 
     return 0
 
 
+def main() -> int:
+    # Only one optional flag, so parse sys.argv directly rather than importing argparse.
+    base_url = os.environ.get("ALLERGEN_API_BASE_URL", "http://127.0.0.1:8000")
+    argv = sys.argv[1:]
+    for i, arg in enumerate(argv):
+        if arg == "--base-url" and i + 1 < len(argv):
+            base_url = argv[i + 1]
+        elif arg.startswith("--base-url="):
+            base_url = arg.split("=", 1)[1]
+    base_url = base_url.rstrip("/")
+    try:
+        # uvloop (libuv) has lower per-request event-loop overhead than the default selector loop.
+        if uvloop is not None:
+            if hasattr(uvloop, "run"):  # uvloop >= 0.18
+                return uvloop.run(amain(base_url))
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return asyncio.run(amain(base_url))
+    finally:
+        flush_results()
+
+
 if __name__ == "__main__":
     sys.exit(main())
-